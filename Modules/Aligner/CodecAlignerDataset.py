@@ -1,12 +1,14 @@
 import os
 import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import librosa
 import soundfile as sf
 import torch
 from speechbrain.pretrained import EncoderClassifier
-from torch.multiprocessing import Manager
-from torch.multiprocessing import Process
 from torch.utils.data import Dataset
 from torchaudio.transforms import Resample
 from tqdm import tqdm
@@ -15,6 +17,8 @@ from Preprocessing.EnCodecAudioPreprocessor import CodecAudioPreprocessor
 from Preprocessing.TextFrontend import ArticulatoryCombinedTextFrontend
 from Utility.storage_config import MODELS_DIR
 
+CACHE_SCHEMA_VERSION = 3  # bump this whenever the layout of the cache tuple changes, so outdated caches are rebuilt instead of misread
+
 
 class CodecAlignerDataset(Dataset):
 
@@ -35,7 +39,21 @@ class CodecAlignerDataset(Dataset):
 
         self.gpu_count = gpu_count
         self.rank = rank
-        if not os.path.exists(os.path.join(cache_dir, "aligner_train_cache.pt")) or rebuild_cache:
+        cache_path = os.path.join(cache_dir, "aligner_train_cache.pt")
+        cache = None
+        if os.path.exists(cache_path) and not rebuild_cache:
+            try:
+                cache = torch.load(cache_path, map_location='cpu')
+            except Exception:
+                # a run that was interrupted while saving leaves a truncated file behind,
+                # which fails during loading already. We rebuild the cache in that case.
+                cache = None
+            if cache is not None and (not isinstance(cache, tuple) or len(cache) < 4 or (len(cache) > 4 and cache[4] != CACHE_SCHEMA_VERSION)):
+                # the cache is in an outdated format, which we rebuild once instead of
+                # trying to recompute the missing parts on every load.
+                # Four-element caches predate the schema stamp but share its layout, so they remain loadable.
+                cache = None
+        if cache is None:
             self._build_dataset_cache(path_to_transcript_dict=path_to_transcript_dict,
                                       cache_dir=cache_dir,
                                       lang=lang,
@@ -48,11 +66,11 @@ class CodecAlignerDataset(Dataset):
                                       allow_unknown_symbols=allow_unknown_symbols,
                                       gpu_count=gpu_count,
                                       rank=rank)
+            cache = torch.load(cache_path, map_location='cpu')
         self.lang = lang
         self.device = device
         self.cache_dir = cache_dir
-        self.tf = ArticulatoryCombinedTextFrontend(language=self.lang, device=device)
-        cache = torch.load(os.path.join(self.cache_dir, "aligner_train_cache.pt"), map_location='cpu')
+        self.tf = get_cached_text_frontend(self.lang, device)
         self.speaker_embeddings = cache[2]
         self.filepaths = cache[3]
         self.datapoints = cache[0]
@@ -88,12 +106,9 @@ class CodecAlignerDataset(Dataset):
             path_to_transcript_dict = path_to_transcript_dict()  # in this case we passed a function instead of the dict, so that the function isn't executed if not necessary.
         torch.multiprocessing.set_start_method('spawn', force=True)
         torch.multiprocessing.set_sharing_strategy('file_system')
-        resource_manager = Manager()
-        self.path_to_transcript_dict = resource_manager.dict(path_to_transcript_dict)
-        key_list = list(self.path_to_transcript_dict.keys())
+        key_list = list(path_to_transcript_dict.keys())
         with open(os.path.join(cache_dir, "files_used.txt"), encoding='utf8', mode="w") as files_used_note:
             files_used_note.write(str(key_list))
-        fisher_yates_shuffle(key_list)
         # build cache
         print("... building dataset cache ...")
         torch.hub._validate_not_a_forked_repo = lambda a, b, c: True  # torch 1.9 has a bug in the hub loading, this is a workaround
@@ -103,101 +118,191 @@ class CodecAlignerDataset(Dataset):
                               force_reload=False,
                               onnx=False,
                               verbose=False)
-        self.result_pool = resource_manager.list()
-        # make processes
-        key_splits = list()
-        process_list = list()
-        for i in range(loading_processes):
-            key_splits.append(
-                key_list[i * len(key_list) // loading_processes:(i + 1) * len(key_list) // loading_processes])
-        for key_split in key_splits:
-            process_list.append(
-                Process(target=self._cache_builder_process,
-                        args=(key_split,
-                              lang,
-                              min_len_in_seconds,
-                              max_len_in_seconds,
-                              verbose,
-                              device,
-                              phone_input,
-                              allow_unknown_symbols),
-                        daemon=True))
-            process_list[-1].start()
-        for process in process_list:
-            process.join()
+        # make processes. Each worker writes its results into its own shard file, so nothing
+        # has to be routed through a shared-memory manager one datapoint at a time.
+        key_splits = balance_key_splits(key_list, loading_processes, min_len_in_seconds, max_len_in_seconds, verbose)
+        with ProcessPoolExecutor(max_workers=loading_processes, mp_context=torch.multiprocessing.get_context('spawn')) as executor:
+            futures = list()
+            for shard_index, key_split in enumerate(key_splits):
+                futures.append(executor.submit(cache_builder_process,
+                                               key_split,
+                                               {path: path_to_transcript_dict[path] for path in key_split},
+                                               lang,
+                                               device,
+                                               phone_input,
+                                               allow_unknown_symbols,
+                                               os.path.join(cache_dir, f"aligner_cache_shard_{shard_index}.pt")))
+            for future in futures:
+                future.result()  # this also surfaces exceptions from the workers, instead of dropping them silently
         print("pooling results...")
-        pooled_datapoints = list()
-        for chunk in self.result_pool:
-            for datapoint in chunk:
-                pooled_datapoints.append(datapoint)  # unpack into a joint list
-        self.result_pool = pooled_datapoints
-        del pooled_datapoints
-        print("converting text to tensors...")
-        text_tensors = [torch.ShortTensor(x[0]) for x in self.result_pool]  # turn everything back to tensors (had to turn it to np arrays to avoid multiprocessing issues)
-        print("converting speech to tensors...")
-        speech_tensors = [torch.ShortTensor(x[1]) for x in self.result_pool]
-        print("converting waves to tensors...")
-        norm_waves = [torch.Tensor(x[2]) for x in self.result_pool]
-        print("unpacking file list...")
-        filepaths = [x[3] for x in self.result_pool]
-        del self.result_pool
-        self.datapoints = list(zip(text_tensors, speech_tensors))
-        del text_tensors
-        del speech_tensors
-        print("done!")
-
-        # add speaker embeddings
+        # the workers have joined by now, so nothing stops the embedding pass from using CUDA,
+        # even if the build itself was pinned to the CPU for the sake of the worker processes.
+        embedding_device = "cuda" if torch.cuda.is_available() else str(device)
+        speaker_embedding_func_ecapa = get_cached_speaker_embedding_function(embedding_device)
+        self.datapoints = list()
         self.speaker_embeddings = list()
-        speaker_embedding_func_ecapa = EncoderClassifier.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb",
-                                                                      run_opts={"device": str(device)},
-                                                                      savedir=os.path.join(MODELS_DIR, "Embedding", "speechbrain_speaker_embedding_ecapa"))
-        with torch.inference_mode():
-            for wave in tqdm(norm_waves):
-                self.speaker_embeddings.append(speaker_embedding_func_ecapa.encode_batch(wavs=wave.to(device).unsqueeze(0)).squeeze().cpu())
+        filepaths = list()
+        # the shards are handled one after the other, so only a single shard's waves ever have
+        # to be held in memory at the same time, rather than the waves of the whole corpus.
+        for shard_index in range(len(key_splits)):
+            shard_path = os.path.join(cache_dir, f"aligner_cache_shard_{shard_index}.pt")
+            if not os.path.exists(shard_path):
+                continue
+            shard = torch.load(shard_path, map_location='cpu')
+            text_tensors = [x[0] for x in shard]  # the workers already store tensors in their final dtypes, now that nothing is piped through shared memory anymore
+            speech_tensors = [x[1] for x in shard]
+            norm_waves = [x[2].float() for x in shard]
+            filepaths.extend([x[3] for x in shard])
+            del shard
+            self.datapoints.extend(zip(text_tensors, speech_tensors))
+            self.speaker_embeddings.extend(self._extract_speaker_embeddings(norm_waves, speaker_embedding_func_ecapa, embedding_device))
+            del norm_waves
+            os.remove(shard_path)
+        # the balanced splits leave the shards roughly sorted by duration, so we shuffle the
+        # pooled datapoints back into a random order, which e.g. the multi-GPU chunking relies on.
+        joint_lists = list(zip(self.datapoints, self.speaker_embeddings, filepaths))
+        fisher_yates_shuffle(joint_lists)
+        self.datapoints = [datapoint for datapoint, _, _ in joint_lists]
+        self.speaker_embeddings = [embedding for _, embedding, _ in joint_lists]
+        filepaths = [filepath for _, _, filepath in joint_lists]
+        print("done!")
 
         # save to cache
         if len(self.datapoints) == 0:
             raise RuntimeError  # something went wrong and there are no datapoints
-        torch.save((self.datapoints, None, self.speaker_embeddings, filepaths),
+        torch.save((self.datapoints, None, self.speaker_embeddings, filepaths, CACHE_SCHEMA_VERSION),
                    os.path.join(cache_dir, "aligner_train_cache.pt"))
 
-    def _cache_builder_process(self,
-                               path_list,
-                               lang,
-                               min_len,
-                               max_len,
-                               verbose,
-                               device,
-                               phone_input,
-                               allow_unknown_symbols):
-        process_internal_dataset_chunk = list()
-        torch.hub._validate_not_a_forked_repo = lambda a, b, c: True  # torch 1.9 has a bug in the hub loading, this is a workaround
-        # careful: assumes 16kHz or 8kHz audio
-        silero_model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad',
-                                             model='silero_vad',
-                                             force_reload=False,
-                                             onnx=False,
-                                             verbose=False)
-        (get_speech_timestamps,
-         save_audio,
-         read_audio,
-         VADIterator,
-         collect_chunks) = utils
-        torch.set_grad_enabled(True)  # finding this issue was very infuriating: silero sets
-        # this to false globally during model loading rather than using inference mode or no_grad
-        silero_model = silero_model.to(device)
-        silence = torch.zeros([16000 // 8]).to(device)
-        tf = ArticulatoryCombinedTextFrontend(language=lang, device=device)
-        _, sr = sf.read(path_list[0])
-        assumed_sr = sr
-        ap = CodecAudioPreprocessor(input_sr=assumed_sr, device=device)
-        resample = Resample(orig_freq=assumed_sr, new_freq=16000).to(device)
-
-        for path in tqdm(path_list):
-            if self.path_to_transcript_dict[path].strip() == "":
-                continue
+    @staticmethod
+    def _extract_speaker_embeddings(norm_waves, speaker_embedding_func_ecapa, device, batch_size=32):
+        # instead of running every wave through the encoder on its own, we sort the waves by length,
+        # so batches can be padded with minimal waste, and run whole batches through the encoder at once.
+        # The original order is restored at the end.
+        order = sorted(range(len(norm_waves)), key=lambda index: len(norm_waves[index]))
+        speaker_embeddings = [None] * len(norm_waves)
+        autocast_device = "cuda" if str(device).startswith("cuda") else "cpu"
+        # the embeddings don't need full precision, so we use half precision to save bandwidth and unlock faster kernels
+        autocast_dtype = torch.float16 if autocast_device == "cuda" else torch.bfloat16
+        with torch.inference_mode(), torch.autocast(device_type=autocast_device, dtype=autocast_dtype):
+            for batch_start in tqdm(range(0, len(order), batch_size)):
+                batch_indexes = order[batch_start:batch_start + batch_size]
+                waves = [norm_waves[index] for index in batch_indexes]
+                wave_lens = torch.tensor([len(wave) for wave in waves], dtype=torch.float32)
+                padded_waves = torch.nn.utils.rnn.pad_sequence(waves, batch_first=True)
+                embeddings = speaker_embedding_func_ecapa.encode_batch(wavs=padded_waves.to(device),
+                                                                       wav_lens=(wave_lens / wave_lens.max()).to(device)).squeeze(1).float().cpu()
+                for index, embedding in zip(batch_indexes, embeddings):
+                    speaker_embeddings[index] = embedding
+        return speaker_embeddings
+
+    def __getitem__(self, index):
+        text_vector = self.datapoints[index][0]
+        tokens = self.tf.text_vectors_to_id_sequence(text_vector=text_vector)
+        tokens = torch.LongTensor(tokens)
+        token_len = torch.LongTensor([len(tokens)])
+
+        codes = self.datapoints[index][1]
+        if codes.size()[0] != 24:  # no clue why this is sometimes the case
+            codes = codes.transpose(0, 1)
+
+        return tokens, \
+            token_len, \
+            codes, \
+            None, \
+            self.speaker_embeddings[index]
+
+    def __len__(self):
+        return len(self.datapoints)
+
+    def remove_samples(self, list_of_samples_to_remove):
+        for remove_id in sorted(list_of_samples_to_remove, reverse=True):
+            self.datapoints.pop(remove_id)
+            self.speaker_embeddings.pop(remove_id)
+            self.filepaths.pop(remove_id)
+        torch.save((self.datapoints, None, self.speaker_embeddings, self.filepaths, CACHE_SCHEMA_VERSION),
+                   os.path.join(self.cache_dir, "aligner_train_cache.pt"))
+        print("Dataset updated!")
+
+
+@lru_cache(maxsize=None)
+def get_cached_text_frontend(lang, device):
+    # constructing the frontend builds the full phone feature table, which is worth reusing
+    # when several datasets in the same language are created within one process
+    return ArticulatoryCombinedTextFrontend(language=lang, device=device)
+
+
+@lru_cache(maxsize=None)
+def get_cached_codec_preprocessor(input_sr, device):
+    return CodecAudioPreprocessor(input_sr=input_sr, device=device)
+
+
+@lru_cache(maxsize=None)
+def get_cached_resampler(input_sr, device):
+    return Resample(orig_freq=input_sr, new_freq=16000).to(device)
+
+
+@lru_cache(maxsize=None)
+def get_cached_speaker_embedding_function(device):
+    # reloading the ECAPA parameters from disk for every dataset adds up
+    # when many datasets are built in one process, e.g. for multilingual training
+    return EncoderClassifier.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb",
+                                          run_opts={"device": device},
+                                          savedir=os.path.join(MODELS_DIR, "Embedding", "speechbrain_speaker_embedding_ecapa"))
+
+
+def cache_builder_process(path_list,
+                          path_to_transcript_dict,
+                          lang,
+                          device,
+                          phone_input,
+                          allow_unknown_symbols,
+                          shard_path):
+    process_internal_dataset_chunk = list()
+    torch.hub._validate_not_a_forked_repo = lambda a, b, c: True  # torch 1.9 has a bug in the hub loading, this is a workaround
+    # careful: assumes 16kHz or 8kHz audio
+    silero_model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad',
+                                         model='silero_vad',
+                                         force_reload=False,
+                                         onnx=False,
+                                         verbose=False)
+    torch.set_grad_enabled(True)  # finding this issue was very infuriating: silero sets
+    # this to false globally during model loading rather than using inference mode or no_grad
+    silero_model = silero_model.to(device)
+    silence = torch.zeros([16000 // 8]).to(device)
+    tf = get_cached_text_frontend(lang, device)
+    assumed_sr = sf.info(path_list[0]).samplerate  # the header is enough to find out the sampling rate, no need to decode the whole file
+    ap = get_cached_codec_preprocessor(assumed_sr, device)
+    resample = get_cached_resampler(assumed_sr, device)
+
+    # files that are unreadable or out of duration bounds were already dropped by the header pass
+    # in the parent, so only empty transcripts are left to filter here
+    path_list = [path for path in path_list if path_to_transcript_dict[path].strip() != ""]
+    # sf.read releases the GIL inside libsndfile, so a small thread pool lets the disk reads
+    # of the next few files overlap with the preprocessing of the current one.
+    prefetch_depth = 4
+    read_executor = ThreadPoolExecutor(max_workers=prefetch_depth)
+    prefetched_reads = deque()
+    for path in path_list[:prefetch_depth]:
+        prefetched_reads.append(read_executor.submit(sf.read, path, dtype='float32'))
+
+    # files are processed in small buckets, so the VAD can run over all waves of a bucket in one
+    # batched forward pass instead of once per file.
+    vad_bucket_size = 16
+    progress_bar = tqdm(total=len(path_list))
+    file_index = 0
+    while file_index < len(path_list):
+        bucket_paths = list()
+        bucket_waves = list()
+        bucket_aps = list()
+        while file_index < len(path_list) and len(bucket_waves) < vad_bucket_size:
+            path = path_list[file_index]
+            read_future = prefetched_reads.popleft()
+            if file_index + prefetch_depth < len(path_list):
+                prefetched_reads.append(read_executor.submit(sf.read, path_list[file_index + prefetch_depth], dtype='float32'))
+            file_index += 1
+            progress_bar.update(1)
             try:
-                wave, sr = sf.read(path)
+                wave, sr = read_future.result()
             except:
                 print(f"Problem with an audio file: {path}")
                 continue
@@ -209,27 +314,35 @@ class CodecAlignerDataset(Dataset):
 
             if sr != assumed_sr:
                 assumed_sr = sr
-                ap = CodecAudioPreprocessor(input_sr=assumed_sr, device=device)
-                resample = Resample(orig_freq=assumed_sr, new_freq=16000).to(device)
+                ap = get_cached_codec_preprocessor(assumed_sr, device)
+                resample = get_cached_resampler(assumed_sr, device)
                 print(f"{path} has a different sampling rate --> adapting the codec processor")
 
             try:
                 norm_wave = resample(torch.tensor(wave).float().to(device))
             except ValueError:
                 continue
-            dur_in_seconds = len(norm_wave) / 16000
-            if not (min_len <= dur_in_seconds <= max_len):
-                if verbose:
-                    print(f"Excluding {path} because of its duration of {round(dur_in_seconds, 2)} seconds.")
-                continue
-            with torch.inference_mode():
-                speech_timestamps = get_speech_timestamps(norm_wave, silero_model, sampling_rate=16000)
+            bucket_paths.append(path)
+            bucket_waves.append(norm_wave)
+            bucket_aps.append(ap)  # the codec processor belonging to this file's sampling rate
+
+        if len(bucket_waves) == 0:
+            continue
+        with torch.inference_mode():
+            padded_waves = torch.nn.utils.rnn.pad_sequence(bucket_waves, batch_first=True)
+            bucket_speech_probs = silero_model.audio_forward(padded_waves.to(device), 16000)
+        # the window size the VAD used is derived from its output rather than hardcoded, so the
+        # timestamps keep their scale even if a new silero version changes its internal chunking
+        num_windows = bucket_speech_probs.shape[-1]
+        window_size_samples = (padded_waves.shape[1] + num_windows - 1) // num_windows
+
+        for norm_wave, path, file_ap, speech_probs in zip(bucket_waves, bucket_paths, bucket_aps, bucket_speech_probs):
+            speech_timestamps = speech_timestamps_from_probabilities(speech_probs, len(norm_wave), window_size_samples)
             try:
                 silence_timestamps = invert_segments(speech_timestamps, len(norm_wave))
                 for silence_timestamp in silence_timestamps:
-                    begin = silence_timestamp['start']
-                    end = silence_timestamp['end']
-                    norm_wave = torch.cat([norm_wave[:begin], torch.zeros([end - begin], device=device), norm_wave[end:]])
+                    # zeroing the slice in place spares us rebuilding the whole wave once per silence segment
+                    norm_wave[silence_timestamp['start']:silence_timestamp['end']] = 0
                 result = norm_wave[speech_timestamps[0]['start']:speech_timestamps[-1]['end']]
             except IndexError:
                 print("Audio might be too short to cut silences from front and back.")
@@ -237,15 +350,15 @@ class CodecAlignerDataset(Dataset):
             norm_wave = torch.cat([silence, result, silence])
 
             # raw audio preprocessing is done
-            transcript = self.path_to_transcript_dict[path]
+            transcript = path_to_transcript_dict[path]
 
             try:
                 try:
-                    cached_text = tf.string_to_tensor(transcript, handle_missing=False, input_phonemes=phone_input).squeeze(0).cpu().numpy()
+                    cached_text = tf.string_to_tensor(transcript, handle_missing=False, input_phonemes=phone_input).squeeze(0).short().cpu()
                 except KeyError:
-                    cached_text = tf.string_to_tensor(transcript, handle_missing=True, input_phonemes=phone_input).squeeze(0).cpu().numpy()
                     if not allow_unknown_symbols:
-                        continue  # we skip sentences with unknown symbols
+                        continue  # we skip sentences with unknown symbols, so there is no point in transcribing them a second time just to discard the result
+                    cached_text = tf.string_to_tensor(transcript, handle_missing=True, input_phonemes=phone_input).squeeze(0).short().cpu()
             except ValueError:
                 # this can happen for Mandarin Chinese, when the syllabification of pinyin doesn't work. In that case, we just skip the sample.
                 continue
@@ -253,40 +366,107 @@ class CodecAlignerDataset(Dataset):
                 # this can happen for Mandarin Chinese, when the syllabification of pinyin doesn't work. In that case, we just skip the sample.
                 continue
 
-            cached_speech = ap.audio_to_codebook_indexes(audio=norm_wave, current_sampling_rate=16000).transpose(0, 1).cpu().numpy()
+            cached_speech = file_ap.audio_to_codebook_indexes(audio=norm_wave, current_sampling_rate=16000).transpose(0, 1).short().cpu()
             process_internal_dataset_chunk.append([cached_text,
                                                    cached_speech,
-                                                   norm_wave.cpu().detach().numpy(),
+                                                   norm_wave.detach().half().cpu(),  # half precision is plenty for the wave, which is only kept for speaker embedding extraction, and halves the shard size
                                                    path])
-        self.result_pool.append(process_internal_dataset_chunk)
-
-    def __getitem__(self, index):
-        text_vector = self.datapoints[index][0]
-        tokens = self.tf.text_vectors_to_id_sequence(text_vector=text_vector)
-        tokens = torch.LongTensor(tokens)
-        token_len = torch.LongTensor([len(tokens)])
+    progress_bar.close()
+    read_executor.shutdown()
+    torch.save(process_internal_dataset_chunk, shard_path)
 
-        codes = self.datapoints[index][1]
-        if codes.size()[0] != 24:  # no clue why this is sometimes the case
-            codes = codes.transpose(0, 1)
 
-        return tokens, \
-            token_len, \
-            codes, \
-            None, \
-            self.speaker_embeddings[index]
+def speech_timestamps_from_probabilities(speech_probs,
+                                         audio_length,
+                                         window_size_samples,
+                                         threshold=0.5,
+                                         min_speech_duration_ms=250,
+                                         min_silence_duration_ms=100,
+                                         speech_pad_ms=30,
+                                         sampling_rate=16000):
+    """
+    Turns the per-window speech probabilities that silero's audio_forward
+    returns for a whole batch into speech timestamps for a single wave.
+    Mirrors the post-processing of get_speech_timestamps with its default
+    parameters, see https://github.com/snakers4/silero-vad
+    """
+    min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
+    min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+    speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+    neg_threshold = threshold - 0.15
+    triggered = False
+    speeches = list()
+    current_speech = dict()
+    temp_end = 0
+    for window_index, speech_prob in enumerate(speech_probs):
+        if window_index * window_size_samples >= audio_length:
+            break  # everything from here on is only padding from the batching
+        if (speech_prob >= threshold) and temp_end:
+            temp_end = 0
+        if (speech_prob >= threshold) and not triggered:
+            triggered = True
+            current_speech['start'] = window_size_samples * window_index
+            continue
+        if (speech_prob < neg_threshold) and triggered:
+            if not temp_end:
+                temp_end = window_size_samples * window_index
+            if (window_size_samples * window_index) - temp_end < min_silence_samples:
+                continue
+            current_speech['end'] = temp_end
+            if (current_speech['end'] - current_speech['start']) > min_speech_samples:
+                speeches.append(current_speech)
+            current_speech = dict()
+            temp_end = 0
+            triggered = False
+    if current_speech and (audio_length - current_speech['start']) > min_speech_samples:
+        current_speech['end'] = audio_length
+        speeches.append(current_speech)
+    for speech_index, speech in enumerate(speeches):
+        if speech_index == 0:
+            speech['start'] = int(max(0, speech['start'] - speech_pad_samples))
+        if speech_index != len(speeches) - 1:
+            silence_duration = speeches[speech_index + 1]['start'] - speech['end']
+            if silence_duration < 2 * speech_pad_samples:
+                speech['end'] += int(silence_duration // 2)
+                speeches[speech_index + 1]['start'] = int(max(0, speeches[speech_index + 1]['start'] - silence_duration // 2))
+            else:
+                speech['end'] = int(min(audio_length, speech['end'] + speech_pad_samples))
+                speeches[speech_index + 1]['start'] = int(max(0, speeches[speech_index + 1]['start'] - speech_pad_samples))
+        else:
+            speech['end'] = int(min(audio_length, speech['end'] + speech_pad_samples))
+    return speeches
 
-    def __len__(self):
-        return len(self.datapoints)
 
-    def remove_samples(self, list_of_samples_to_remove):
-        for remove_id in sorted(list_of_samples_to_remove, reverse=True):
-            self.datapoints.pop(remove_id)
-            self.speaker_embeddings.pop(remove_id)
-            self.filepaths.pop(remove_id)
-        torch.save((self.datapoints, None, self.speaker_embeddings, self.filepaths),
-                   os.path.join(self.cache_dir, "aligner_train_cache.pt"))
-        print("Dataset updated!")
+def balance_key_splits(key_list, number_of_splits, min_len, max_len, verbose):
+    """
+    Greedily assigns files to workers by descending duration, so every
+    worker gets roughly the same total amount of audio and a few long
+    files can't leave one straggler holding up the whole join. Since the
+    headers are read here anyway, files outside the duration bounds are
+    dropped in the same pass instead of making every worker read the
+    same headers again.
+    """
+    paths = list()
+    durations = list()
+    for path in key_list:
+        try:
+            duration = sf.info(path).duration
+        except:
+            print(f"Problem with an audio file: {path}")
+            continue
+        if not (min_len <= duration <= max_len):
+            if verbose:
+                print(f"Excluding {path} because of its duration of {round(duration, 2)} seconds.")
+            continue
+        paths.append(path)
+        durations.append(duration)
+    splits = [list() for _ in range(number_of_splits)]
+    split_loads = [0.0] * number_of_splits
+    for index in sorted(range(len(paths)), key=lambda i: durations[i], reverse=True):
+        lightest_split = split_loads.index(min(split_loads))
+        splits[lightest_split].append(paths[index])
+        split_loads[lightest_split] += durations[index]
+    return [split for split in splits if len(split) > 0]  # with fewer files than workers, some splits stay empty and would crash their worker
 
 
 def fisher_yates_shuffle(lst):
@@ -93,9 +93,12 @@ class TTSDataset(Dataset):
                                 max_len_in_seconds=max_len_in_seconds,
                                 rebuild_cache=rebuild_cache,
                                 device=device)
-        datapoints = torch.load(os.path.join(cache_dir, "aligner_train_cache.pt"), map_location='cpu')
+        # memory-mapping the aligner cache lets the OS page the tensors in lazily instead of copying
+        # the whole file into RAM up front. This is safe here, because the aligner cache is only read
+        # during the TTS cache build, never written back from these tensors.
+        datapoints = torch.load(os.path.join(cache_dir, "aligner_train_cache.pt"), map_location='cpu', mmap=True)
         # we use the aligner dataset as basis and augment it to contain the additional information we need for tts.
-        self.dataset, _, speaker_embeddings, filepaths = datapoints
+        self.dataset, _, speaker_embeddings, filepaths = datapoints[:4]  # newer caches carry a schema version stamp behind these four elements
 
         print("... building dataset cache ...")
         self.codec_wrapper = CodecAudioPreprocessor(input_sr=-1, device=device)
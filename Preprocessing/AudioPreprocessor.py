@@ -7,15 +7,21 @@ from torchaudio.transforms import Resample
 
 class AudioPreprocessor:
 
-    def __init__(self, input_sr, output_sr=None, cut_silence=False, do_loudnorm=False, device="cpu"):
+    def __init__(self, input_sr, output_sr=None, cut_silence=False, do_loudnorm=False, device="cpu", vad_mode="silero"):
         """
         The parameters are by default set up to do well
         on a 16kHz signal. A different sampling rate may
         require different hop_length and n_fft (e.g.
         doubling frequency --> doubling hop_length and
         doubling n_fft)
+
+        vad_mode controls how silence is cut when cut_silence is
+        True: "silero" uses the neural VAD, "threshold" trims by a
+        simple amplitude threshold without loading any model, and
+        "off" disables the cutting entirely.
         """
         self.cut_silence = cut_silence
+        self.vad_mode = vad_mode
         self.do_loudnorm = do_loudnorm
         self.device = device
         self.input_sr = input_sr
@@ -23,7 +29,7 @@ class AudioPreprocessor:
         self.meter = pyln.Meter(input_sr)
         self.final_sr = input_sr
         self.wave_to_spectrogram = LogMelSpec(output_sr if output_sr is not None else input_sr).to(device)
-        if cut_silence:
+        if cut_silence and vad_mode == "silero":
             torch.hub._validate_not_a_forked_repo = lambda a, b, c: True  # torch 1.9 has a bug in the hub loading, this is a workaround
             # careful: assumes 16kHz or 8kHz audio
             self.silero_model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad',
@@ -39,8 +45,10 @@ class AudioPreprocessor:
             torch.set_grad_enabled(True)  # finding this issue was very infuriating: silero sets
             # this to false globally during model loading rather than using inference mode or no_grad
             self.silero_model = self.silero_model.to(self.device)
+        self.resample_cache = dict()  # reusing resamplers across calls saves rebuilding their kernels whenever sampling rates alternate between files
         if output_sr is not None and output_sr != input_sr:
             self.resample = Resample(orig_freq=input_sr, new_freq=output_sr).to(self.device)
+            self.resample_cache[input_sr] = self.resample
             self.final_sr = output_sr
         else:
             self.resample = lambda x: x
@@ -49,6 +57,13 @@ class AudioPreprocessor:
         """
         https://github.com/snakers4/silero-vad
         """
+        if self.vad_mode == "threshold":
+            # a plain amplitude threshold is often good enough and
+            # spares us a neural VAD forward pass per file
+            voiced = torch.nonzero(audio.abs() > 1e-3, as_tuple=True)[0]
+            if len(voiced) == 0:
+                return audio
+            return audio[voiced[0]:voiced[-1] + 1]
         with torch.inference_mode():
             speech_timestamps = self.get_speech_timestamps(audio, self.silero_model, sampling_rate=self.final_sr)
         try:
@@ -84,7 +99,7 @@ class AudioPreprocessor:
             audio = self.normalize_loudness(audio)
         audio = torch.tensor(audio, device=self.device, dtype=torch.float32)
         audio = self.resample(audio)
-        if self.cut_silence:
+        if self.cut_silence and self.vad_mode != "off":
             audio = self.cut_leading_and_trailing_silence(audio)
         return audio
 
@@ -102,8 +117,10 @@ class AudioPreprocessor:
             return self.wave_to_spectrogram(audio.float())
         else:
             if explicit_sampling_rate != self.input_sr:
-                print("WARNING: different sampling rate used, this will be very slow if it happens often. Consider creating a dedicated audio processor.")
-                self.resample = Resample(orig_freq=explicit_sampling_rate, new_freq=self.output_sr).to(self.device)
+                if explicit_sampling_rate not in self.resample_cache:
+                    print("WARNING: different sampling rate used. A new resampler is created for it and reused if this sampling rate occurs again. Consider creating a dedicated audio processor.")
+                    self.resample_cache[explicit_sampling_rate] = Resample(orig_freq=explicit_sampling_rate, new_freq=self.output_sr).to(self.device)
+                self.resample = self.resample_cache[explicit_sampling_rate]
                 self.input_sr = explicit_sampling_rate
             audio = self.resample(audio.float())
             return self.wave_to_spectrogram(audio)
@@ -608,7 +608,12 @@ class ArticulatoryCombinedTextFrontend:
         self.phone_to_vector = generate_feature_table()
         self.phone_to_id = get_phone_to_id()
         self.id_to_phone = {v: k for k, v in self.phone_to_id.items()}
-        self.text_vector_to_phone_cache = dict()
+        # the first 13 dimensions are for modifiers, so we ignore those when building the lookup of phoneme IDs.
+        # The feature table also contains pseudo-phones like the word boundary, which have no ID and
+        # never survived the old linear search either, so they are left out of the lookup.
+        phones_with_ids = [phone for phone in self.phone_to_vector if phone in self.phone_to_id]
+        self.phone_vector_table = torch.tensor([self.phone_to_vector[phone][13:] for phone in phones_with_ids], dtype=torch.float32)
+        self.phone_vector_ids = torch.tensor([self.phone_to_id[phone] for phone in phones_with_ids], dtype=torch.long)
 
     @staticmethod
     def get_example_sentence(lang):
@@ -1019,28 +1024,19 @@ class ArticulatoryCombinedTextFrontend:
         return phones
 
     def text_vectors_to_id_sequence(self, text_vector):
-        tokens = list()
-        for vector in text_vector:
-            if vector[get_feature_to_index_lookup()["word-boundary"]] == 0:
-                # we don't include word boundaries when performing alignment, since they are not always present in audio.
-                features = vector.cpu().numpy().tolist()
-                immutable_vector = tuple(features)
-                if immutable_vector in self.text_vector_to_phone_cache:
-                    tokens.append(self.phone_to_id[self.text_vector_to_phone_cache[immutable_vector]])
-                    continue
-                features = features[13:]
-                # the first 12 dimensions are for modifiers, so we ignore those when trying to find the phoneme in the ID lookup
-                for index in range(len(features)):
-                    if features[index] == 2:
-                        # we remove all features that stem from a modifier, so we can map back to the unmodified sound
-                        features[index] = 0
-                for phone in self.phone_to_vector:
-                    if features == self.phone_to_vector[phone][13:]:
-                        tokens.append(self.phone_to_id[phone])
-                        self.text_vector_to_phone_cache[immutable_vector] = phone
-                        # this is terribly inefficient, but it's fine, since we're building a cache over time that makes this instant
-                        break
-        return tokens
+        if not isinstance(text_vector, torch.Tensor):
+            text_vector = torch.tensor(text_vector)
+        text_vector = text_vector.cpu().float()
+        # we don't include word boundaries when performing alignment, since they are not always present in audio.
+        no_word_boundary = text_vector[:, get_feature_to_index_lookup()["word-boundary"]] == 0
+        features = text_vector[:, 13:]
+        # the first 12 dimensions are for modifiers, so we ignore those when trying to find the phoneme in the ID lookup.
+        # we also remove all features that stem from a modifier, so we can map back to the unmodified sound.
+        features = torch.where(features == 2.0, torch.zeros_like(features), features)
+        # match every vector against the whole phone inventory in one batched comparison
+        matches = (features.unsqueeze(1) == self.phone_vector_table.unsqueeze(0)).all(dim=2)
+        phone_ids = self.phone_vector_ids[matches.float().argmax(dim=1)]  # argmax takes the first match, like the linear search did
+        return phone_ids[no_word_boundary & matches.any(dim=1)].tolist()
 
 
 def english_text_expansion(text):